@@ -1,24 +1,33 @@
 import json
 import time
-import datetime
 import os
 import random
 import threading
 import re
+import urllib.parse
+import urllib.request
 import feedparser
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from llama_cpp import Llama
 
-from settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, PORT, SLEEP_TIME
+from settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, ARCHIVE_FILE, PORT, SLEEP_TIME, LLAMA_PARAMS, NEWS_TIMEOUT_SEC
+from settings import ACTION_RATE_PER_CLIENT, ACTION_BURST_PER_CLIENT, ACTION_RATE_GLOBAL, ACTION_BURST_GLOBAL, MAX_PENDING_REQUESTS
+from settings import TICK_DEADLINE_SEC, CALL_DEADLINE_SEC
+from admission import AdmissionController
+from deadline import Deadline, DeadlineStats
+from records import CompanyState, HistoryEvent, Tweet, load_history, dump_history, dumps_pretty, archive_line
 
 print(f"--- 🏰 魏ホールディングス Sync版 ({MODEL_PATH}) ---")
 
 # ★ ロック定義
 model_lock = threading.Lock() # AI生成中のロック
-data_lock = threading.Lock()  # JSON読み書き中のロック（これ重要！）
+data_lock = threading.RLock() # JSON読み書き中のロック（これ重要！ロック内から load/save を呼ぶので再入可）
+reset_generation = 0          # リセット回数（介入ワーカーが処理中にリセットされたかの判定用）
+deadline_stats = DeadlineStats()  # 締め切り超過回数・ティック所要時間
+admission = AdmissionController(ACTION_RATE_PER_CLIENT, ACTION_BURST_PER_CLIENT, ACTION_RATE_GLOBAL, ACTION_BURST_GLOBAL, MAX_PENDING_REQUESTS)
 
 try:
-    llm = Llama(model_path=MODEL_PATH, n_gpu_layers=25, n_ctx=8192, verbose=False)
+    llm = Llama(model_path=MODEL_PATH, verbose=False, **LLAMA_PARAMS)
     print("✅ Qwen2.5 起動完了")
 except Exception as e:
     print(f"❌ モデルエラー: {e}")
@@ -37,7 +46,14 @@ def save_json_safe(path, data):
     """排他制御付きセーブ"""
     with data_lock:
         with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.write(dumps_pretty(data))
+
+def append_archive(entries):
+    """(kind, record) をアーカイブ(JSONL)へ追記。検索インデックスはここから作られる"""
+    if not entries: return
+    with data_lock:
+        with open(ARCHIVE_FILE, "a", encoding="utf-8") as f:
+            f.writelines(archive_line(kind, r) for kind, r in entries)
 
 def extract_json(text):
     try:
@@ -51,24 +67,31 @@ def extract_json(text):
     except: pass
     return None
 
-def chat_generate(messages, max_tokens=200):
-    with model_lock:
-        try:
-            response = llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0.8)
-            return response['choices'][0]['message']['content'].strip()
-        except: return ""
-
-def safe_int(val):
+def chat_generate(messages, max_tokens=200, deadline=None):
+    """締め切り（ティック全体と1回ごとの早い方）を過ぎたらトークン境界で打ち切り、None を返す"""
+    call = deadline.within(CALL_DEADLINE_SEC) if deadline else Deadline(CALL_DEADLINE_SEC)
+    if not model_lock.acquire(timeout=call.remaining()):
+        deadline_stats.miss("model_lock"); deadline_stats.miss_tick(deadline); return None
     try:
-        clean_val = str(val).replace(",", "").replace("+", "").replace(" ", "")
-        return int(float(clean_val))
-    except: return 0
+        chunks = []
+        for chunk in llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0.8, stream=True):
+            if call.expired():
+                deadline_stats.miss("generate"); deadline_stats.miss_tick(deadline); print("⏳ 生成打ち切り（締め切り超過）")
+                return None
+            chunks.append(chunk['choices'][0]['delta'].get('content') or "")
+        return "".join(chunks).strip()
+    except: return ""
+    finally: model_lock.release()
 
 # --- 📰 ニュース取得 ---
-def get_ai_news():
+def get_ai_news(deadline=None):
+    timeout = min(NEWS_TIMEOUT_SEC, deadline.remaining()) if deadline else NEWS_TIMEOUT_SEC
+    if timeout <= 0: deadline_stats.miss("news"); return None
     rss_url = "https://news.google.com/rss/search?q=AI技術+when:1d&hl=ja&gl=JP&ceid=JP:ja"
     try:
-        feed = feedparser.parse(rss_url)
+        # feedparser に URL を渡すとタイムアウトが効かないので、自前で取得してから渡す
+        with urllib.request.urlopen(urllib.parse.quote(rss_url, safe=":/?=&+"), timeout=timeout) as response:
+            feed = feedparser.parse(response.read())
         if feed.entries:
             entry = random.choice(feed.entries[:5])
             summary = entry.summary[:150] + "..." if 'summary' in entry else "詳細不明"
@@ -78,21 +101,17 @@ def get_ai_news():
 
 # --- 📊 経営評価 ---
 def evaluate_status(state):
-    f = safe_int(state['funds'])
-    risk = safe_int(state['risk'])
-    morale = safe_int(state['morale'])
-    
-    if risk > 60: state['reputation'] = "炎上中🔥"; state['rating'] = "危険"
-    elif morale < 30: state['reputation'] = "ブラック"; state['rating'] = "悪化"
-    elif f > 5000: state['reputation'] = "優良企業"; state['rating'] = "安泰"
-    else: state['reputation'] = "様子見"; state['rating'] = "安定"
+    if state.risk > 60: state.reputation = "炎上中🔥"; state.rating = "危険"
+    elif state.morale < 30: state.reputation = "ブラック"; state.rating = "悪化"
+    elif state.funds > 5000: state.reputation = "優良企業"; state.rating = "安泰"
+    else: state.reputation = "様子見"; state.rating = "安定"
     return state
 
 # --- 🧠 生成ロジック ---
 
-def generate_event(state):
+def generate_event(state, deadline=None):
     print("🎲 自動イベント生成中...")
-    news = get_ai_news()
+    news = get_ai_news(deadline)
     news_context = ""
     news_url = ""
     
@@ -113,7 +132,7 @@ def generate_event(state):
     else:
         news_context = "社内で起きたユニークなトラブルや成功イベントを作成してください。"
 
-    situation = f"資金{state['funds']}、士気{state['morale']}、リスク{state['risk']}"
+    situation = f"資金{state.funds}、士気{state.morale}、リスク{state.risk}"
     members_str = ", ".join(CHARACTERS.keys())
 
     messages = [
@@ -130,7 +149,7 @@ def generate_event(state):
         {"role": "user", "content": f"状況: {situation}\n{news_context}"}
     ]
 
-    data = extract_json(chat_generate(messages, max_tokens=500))
+    data = extract_json(chat_generate(messages, max_tokens=500, deadline=deadline) or "")
     if data and "changes" in data:
         if data.get('proposer') not in CHARACTERS: data['proposer'] = "曹操"
         data['news_url'] = news_url
@@ -139,7 +158,7 @@ def generate_event(state):
     return {"title": "平穏な一日", "description": "特になし。", "proposer": "荀攸", "changes": {"funds": -10, "morale": 0, "risk": -5}, "news_url": ""}
 
 
-def generate_intervention(action_type, state):
+def generate_intervention(action_type, state, deadline=None):
     print(f"⚡ 介入イベント生成中: {action_type}")
     members_str = ", ".join(CHARACTERS.keys())
     
@@ -160,7 +179,7 @@ def generate_intervention(action_type, state):
 出力JSON: {"title": "勅命", "description": "内容", "changes": {"funds": 変動値, "morale": 変動値, "risk": 変動値}}"""
 
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": "生成せよ"}]
-    data = extract_json(chat_generate(messages, max_tokens=500))
+    data = extract_json(chat_generate(messages, max_tokens=500, deadline=deadline) or "")
     
     if data and "changes" in data:
         data['proposer'] = "天の声"
@@ -168,7 +187,7 @@ def generate_intervention(action_type, state):
     return {"title": "エラー", "description": "失敗", "proposer": "システム", "changes": {}}
 
 
-def update_ministers_comments(state, event_data):
+def update_ministers_comments(state, event_data, deadline=None):
     print("💬 武将コメント...")
     new_comments = {}
     for name, char_data in CHARACTERS.items():
@@ -178,11 +197,20 @@ def update_ministers_comments(state, event_data):
             {"role": "system", "content": f"あなたは{name}。役割:{char_data['desc']} 口調:{char_data['style']} スタンス:{stance}。30文字以内でコメントして。"},
             {"role": "user", "content": f"イベント: {event_data['title']}\n詳細: {event_data['description']}"}
         ]
-        text = chat_generate(messages, max_tokens=60).replace("「", "").replace("」", "")
-        new_comments[name] = text
+        if deadline and deadline.expired():
+            text = None; deadline_stats.miss("skipped_call"); deadline_stats.miss_tick(deadline)
+        else:
+            text = chat_generate(messages, max_tokens=60, deadline=deadline)
+        # 締め切り超過時は前回のコメントを使い回す（無ければスタンスだけ）
+        if text is None: text = state.comments.get(name) or f"（{stance}）"
+        new_comments[name] = text.replace("「", "").replace("」", "")
     return new_comments
 
-def generate_sns_reactions(event_data, current_sns_log, comments):
+def merge_comments(current, generated, snapshot):
+    """生成したコメントのうち、読み出し時点から変わったもの（=今回生成できたもの）だけを current に重ねる"""
+    return {**current, **{k: v for k, v in generated.items() if v != snapshot.get(k)}}
+
+def generate_sns_reactions(event_data, current_sns_log, comments, deadline=None):
     print("📱 SNS反応...")
     targets = random.sample(MOBS, 3)
     if random.random() < 0.3: targets.append(random.choice(RIVALS))
@@ -196,8 +224,13 @@ def generate_sns_reactions(event_data, current_sns_log, comments):
             {"role": "system", "content": f"あなたはSNSユーザー「{user['name']}」。{user['desc']}。タメ口30文字以内で反応して。"},
             {"role": "user", "content": f"ニュース: {event_data['description']}\n経営陣:\n{context}"}
         ]
-        text = chat_generate(messages, max_tokens=60).replace("「", "").replace("」", "")
-        new_tweets.append({"name": user['name'], "id": user['id'], "content": text, "is_vip": user in RIVALS, "timestamp": datetime.datetime.now().strftime("%H:%M")})
+        if deadline and deadline.expired():
+            text = None; deadline_stats.miss("skipped_call"); deadline_stats.miss_tick(deadline)
+        else:
+            text = chat_generate(messages, max_tokens=60, deadline=deadline)
+        # 締め切り超過時はそのユーザーは今回は投稿しない（タイムラインは前回のまま残る）
+        if text is None: continue
+        new_tweets.append(Tweet(user['name'], user['id'], text.replace("「", "").replace("」", ""), user in RIVALS))
     
     return (new_tweets + current_sns_log)[:30]
 
@@ -206,21 +239,21 @@ def simulation_loop():
     os.makedirs("./data", exist_ok=True)
     while True:
         # 1. データの読み込み（生成に必要な情報だけ取る）
-        initial_load_state = load_json_safe(DATA_FILE, INITIAL_STATE)
+        tick_started = time.monotonic()
+        deadline = Deadline(TICK_DEADLINE_SEC)
+        initial_load_state = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
         
         # 2. イベント生成（時間がかかる処理。ロックはしない）
-        event_data = generate_event(initial_load_state)
+        event_data = generate_event(initial_load_state, deadline)
         
         # 3. データの更新（ここでロックして、最新の状態に対して書き込む）
         #    生成中にAPIが書き込んでいても、ここで最新版を再ロードして追記するので消えません。
         with data_lock:
-            state = load_json_safe(DATA_FILE, INITIAL_STATE) # 最新をリロード
-            history = load_json_safe(HISTORY_FILE, [])
+            state = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE)) # 最新をリロード
             
-            changes = event_data['changes']
-            state['funds'] += safe_int(changes.get('funds', 0))
-            state['morale'] += safe_int(changes.get('morale', 0))
-            state['risk'] += safe_int(changes.get('risk', 0))
+            # LLM出力はここで一度だけ検証・型変換する（timestamp は保存時に付け直す）
+            log_entry = HistoryEvent.from_dict({**event_data, "timestamp": None})
+            state.apply(log_entry.changes)
             state = evaluate_status(state)
             
             # コメント生成などはLLMを使うのでロック内でやると重いが、
@@ -232,91 +265,107 @@ def simulation_loop():
             # データロックはいったん解除して、コメントとSNSを作る（時間がかかるから）
         
         # 4. 付帯情報生成（コメント・SNS）
-        comments = update_ministers_comments(state, event_data)
-        sns_log = generate_sns_reactions(event_data, state.get('sns', []), comments)
+        comments = update_ministers_comments(state, event_data, deadline)
+        prev_comments, prev_sns = state.comments, state.sns
+        sns_log = generate_sns_reactions(event_data, prev_sns, comments, deadline)
+        deadline_stats.tick(time.monotonic() - tick_started)
 
         # 5. 最終保存（もう一度ロックして書き込む）
         with data_lock:
             # 再度リロード（念には念を）
-            state = load_json_safe(DATA_FILE, INITIAL_STATE)
-            history = load_json_safe(HISTORY_FILE, [])
+            state = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
+            history = load_history(load_json_safe(HISTORY_FILE, []))
             
             # 数値変動を再適用（重複適用しないよう、本当はDiffでやるべきだが、簡易的に上書き）
             # 今回は「イベント生成時点の変動」を適用する
-            state['funds'] += safe_int(changes.get('funds', 0))
-            state['morale'] += safe_int(changes.get('morale', 0))
-            state['risk'] += safe_int(changes.get('risk', 0))
+            log_entry = HistoryEvent.from_dict({**event_data, "timestamp": None})
+            state.apply(log_entry.changes)
             state = evaluate_status(state)
             
-            state['comments'] = comments
-            state['sns'] = sns_log
-
-            log_entry = {
-                "timestamp": datetime.datetime.now().strftime("%H:%M"),
-                "title": event_data['title'],
-                "description": event_data['description'],
-                "proposer": event_data.get("proposer", "不明"),
-                "news_url": event_data.get("news_url", ""),
-                "changes": changes
-            }
+            # 生成中に介入ワーカーが書いた分を潰さないよう、このティックで増えた分だけ重ねる
+            state.comments = merge_comments(state.comments, comments, prev_comments)
+            new_sns = [t for t in sns_log if t not in prev_sns]
+            state.sns = (new_sns + state.sns)[:30]
+
             history.insert(0, log_entry)
             if len(history) > 30: history.pop()
             
-            save_json_safe(DATA_FILE, state)
-            save_json_safe(HISTORY_FILE, history)
+            save_json_safe(DATA_FILE, state.to_dict())
+            save_json_safe(HISTORY_FILE, dump_history(history))
+            append_archive([("event", log_entry)] + [("tweet", t) for t in new_sns])
         
+        print(f"⏱️ 生成 p50={deadline_stats.percentile(0.5):.1f}s p99={deadline_stats.percentile(0.99):.1f}s 超過={dict(deadline_stats.misses)}")
         print(f"💤 {SLEEP_TIME}秒 待機...")
         time.sleep(SLEEP_TIME)
 
+# --- ⚡ 介入ワーカー ---
+def run_intervention(action_type):
+    started = time.monotonic()
+    deadline = Deadline(TICK_DEADLINE_SEC)
+    generation = reset_generation
+    state_snapshot = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
+    event_data = generate_intervention(action_type, state_snapshot, deadline)
+    comments = update_ministers_comments(state_snapshot, event_data, deadline)
+    sns_log = generate_sns_reactions(event_data, state_snapshot.sns, comments, deadline)
+    deadline_stats.tick(time.monotonic() - started)  # 定例ティックと同じく生成部分だけを計る
+
+    # ★ LLM生成はすべて終わっているので、ここでロックして保存
+    with data_lock:
+        # 生成中にリセットされた場合だけ捨てる
+        if reset_generation != generation: return
+
+        state = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
+        history = load_history(load_json_safe(HISTORY_FILE, []))
+        
+        log_entry = HistoryEvent.from_dict({**event_data, "proposer": "天の声", "news_url": "", "timestamp": None})
+        state.apply(log_entry.changes)
+        state = evaluate_status(state)
+        
+        state.comments = merge_comments(state.comments, comments, state_snapshot.comments)
+        new_sns = [t for t in sns_log if t not in state_snapshot.sns]
+        state.sns = (new_sns + state.sns)[:30]
+
+        history.insert(0, log_entry)
+        if len(history) > 30: history.pop()
+
+        save_json_safe(DATA_FILE, state.to_dict())
+        save_json_safe(HISTORY_FILE, dump_history(history))
+        append_archive([("event", log_entry)] + [("tweet", t) for t in new_sns])
+
+def intervention_worker():
+    """受け付けた介入を1件ずつ処理する（同時に走るLLMパイプラインは常に1本）"""
+    while True:
+        action_type = admission.next_action()
+        started = time.monotonic()
+        try: run_intervention(action_type)
+        except Exception as e: print(f"Server Error: {e}")
+        finally: admission.done(time.monotonic() - started)
+
 # --- 🌍 Webサーバー ---
 class CustomHandler(SimpleHTTPRequestHandler):
     def do_POST(self):
+        global reset_generation
         action_type = self.path.split('/')[-1]
         try:
             if action_type == 'reset':
-                save_json_safe(DATA_FILE, INITIAL_STATE.copy())
-                save_json_safe(HISTORY_FILE, [{"timestamp": datetime.datetime.now().strftime("%H:%M"), "title": "再創業", "description": "リセット完了", "proposer": "システム", "changes": {}}])
+                with data_lock:
+                    save_json_safe(DATA_FILE, INITIAL_STATE.copy())
+                    save_json_safe(HISTORY_FILE, [HistoryEvent("再創業", "リセット完了", "システム").to_dict()])
+                    reset_generation += 1
+                admission.clear()
                 self.send_response(200); self.end_headers(); self.wfile.write(b'OK'); return
 
-            # 介入イベント生成（LLM使用）
-            state_snapshot = load_json_safe(DATA_FILE, INITIAL_STATE)
-            event_data = generate_intervention(action_type, state_snapshot)
-            
-            # 付帯情報生成
-            comments = update_ministers_comments(state_snapshot, event_data)
-            
-            # ★ ここでロックして保存
-            with data_lock:
-                state = load_json_safe(DATA_FILE, INITIAL_STATE)
-                history = load_json_safe(HISTORY_FILE, [])
-                
-                changes = event_data['changes']
-                state['funds'] += safe_int(changes.get('funds', 0))
-                state['morale'] += safe_int(changes.get('morale', 0))
-                state['risk'] += safe_int(changes.get('risk', 0))
-                state = evaluate_status(state)
-                
-                state['comments'] = comments
-                state['sns'] = generate_sns_reactions(event_data, state.get('sns', []), comments)
-
-                log_entry = {
-                    "timestamp": datetime.datetime.now().strftime("%H:%M"),
-                    "title": event_data['title'],
-                    "description": event_data['description'],
-                    "proposer": "天の声",
-                    "news_url": "",
-                    "changes": changes
-                }
-                history.insert(0, log_entry)
-                if len(history) > 30: history.pop()
-
-                save_json_safe(DATA_FILE, state)
-                save_json_safe(HISTORY_FILE, history)
-                
-            self.send_response(200); self.end_headers(); self.wfile.write(b'OK')
+            # 介入イベント（LLM使用）はキューに積んでワーカーに任せる
+            if action_type in ['edict', 'audit', 'rumor']:
+                status, retry_after, merged = admission.admit(self.client_address[0], action_type)
+                if status in ("rate_limited", "queue_full"):
+                    self.send_response(429); self.send_header('Retry-After', str(retry_after))
+                    self.end_headers(); self.wfile.write(status.encode()); return
+                self.send_response(202); self.end_headers(); self.wfile.write(b'MERGED' if merged else b'QUEUED'); return
+            self.send_response(400); self.end_headers()
         except Exception as e:
             print(f"Server Error: {e}")
-            self.send_response(500)
+            self.send_response(500); self.end_headers()
 
 class ReusableHTTPServer(HTTPServer):
     allow_reuse_address = True
@@ -329,4 +378,5 @@ def server_loop():
 if __name__ == "__main__":
     t_server = threading.Thread(target=server_loop, daemon=True)
     t_server.start()
+    threading.Thread(target=intervention_worker, daemon=True).start()
     simulation_loop()
\ No newline at end of file
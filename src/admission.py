@@ -0,0 +1,131 @@
+# src/admission.py
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# --- 🚦 流入制御 ---
+# 介入API（edict / audit / rumor）は1件ごとにLLMパイプラインを丸ごと回すので、
+# 受け付けた時点でキューに積み、専用ワーカーが1件ずつ処理する。
+#   - クライアント単位 + 全体のトークンバケットで頻度を制限
+#   - 未着手の同一アクションは1件にまとめる（LLMパイプラインは1回しか回らない）
+#   - まとめた分も含めた受付件数に上限を設け、溢れたら 429 + Retry-After
+
+
+class TokenBucket:
+    """rate 個/秒で補充、最大 burst 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now=None):
+        """取れたら 0、取れなければ次のトークンまでの秒数を返す"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class AdmissionController:
+    MAX_CLIENTS = 1024      # これを超えたら最も長く来ていないクライアントのバケットから捨てる
+    MAX_RETRY_AFTER = 3600  # Retry-After の上限（rate=0 などで待ち時間が無限になる場合も含む）
+
+    def __init__(self, client_rate, client_burst, global_rate, global_burst, max_pending, default_job_sec=60):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.clients = OrderedDict()  # client -> TokenBucket（最後に来た順）
+        self.max_pending = max_pending  # まとめた分も含めた未着手の受付件数の上限
+        self.pending = OrderedDict()  # action -> 受付件数（まとめた件数）
+        self.running = None
+        self.avg_job_sec = default_job_sec  # 処理時間の移動平均（Retry-After の見積もり用）
+        self.stats = {"accepted": 0, "merged": 0, "rate_limited": 0, "queue_full": 0}
+        self.cond = threading.Condition()
+
+    def _client_bucket(self, client, now):
+        bucket = self.clients.get(client)
+        if bucket is None:
+            while len(self.clients) >= self.MAX_CLIENTS:
+                self.clients.popitem(last=False)
+            bucket = self.clients[client] = TokenBucket(self.client_rate, self.client_burst)
+        else:
+            self.clients.move_to_end(client)
+        return bucket
+
+    def _retry_after(self, seconds):
+        return math.ceil(min(seconds, self.MAX_RETRY_AFTER))
+
+    def _queue_wait(self):
+        return self.avg_job_sec * (len(self.pending) + (1 if self.running else 0))
+
+    def admit(self, client, action):
+        """
+        受付判定。(status, retry_after, merged) を返す
+        status: "accepted" / "merged" / "rate_limited" / "queue_full"
+        """
+        with self.cond:
+            now = time.monotonic()
+
+            if sum(self.pending.values()) >= self.max_pending:
+                self.stats["queue_full"] += 1
+                return "queue_full", self._retry_after(self._queue_wait()), False
+
+            wait = self._client_bucket(client, now).try_take(now)
+            if wait:
+                self.stats["rate_limited"] += 1
+                return "rate_limited", self._retry_after(wait), False
+            wait = self.global_bucket.try_take(now)
+            if wait:
+                self.clients[client].give_back()
+                self.stats["rate_limited"] += 1
+                return "rate_limited", self._retry_after(wait), False
+
+            # 同じアクションが未着手で待っていれば、それに相乗りする
+            if action in self.pending:
+                self.pending[action] += 1
+                self.stats["merged"] += 1
+                return "merged", 0, True
+
+            self.pending[action] = 1
+            self.stats["accepted"] += 1
+            self.cond.notify()
+            return "accepted", 0, False
+
+    def next_action(self):
+        """次に処理するアクションを取り出す（無ければ待つ）"""
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            action, _ = self.pending.popitem(last=False)
+            self.running = action
+            return action
+
+    def done(self, elapsed):
+        with self.cond:
+            self.running = None
+            self.avg_job_sec = 0.8 * self.avg_job_sec + 0.2 * elapsed
+
+    def clear(self):
+        """リセット時に未着手の待ち行列を捨てる"""
+        with self.cond:
+            self.pending.clear()
+
+    def snapshot(self):
+        with self.cond:
+            return {"pending": list(self.pending.items()), "running": self.running, **self.stats}
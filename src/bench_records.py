@@ -0,0 +1,50 @@
+# src/bench_records.py
+# 旧来の dict + indent=2 と、レコード型 + コンパクトエンコーダの比較
+# 使い方: python src/bench_records.py [件数]
+import sys
+import json
+import time
+import tracemalloc
+
+try:
+    from records import HistoryEvent, dumps_compact, dumps_pretty
+except ImportError:
+    from src.records import HistoryEvent, dumps_compact, dumps_pretty
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+# 時刻の整形コストを計測に混ぜないよう、両方とも定数の timestamp を使う
+def make_dict(i):
+    return {"timestamp": "19:21", "title": f"イベント{i}", "description": "郭嘉が新たな戦略を策定した。",
+            "proposer": "郭嘉", "news_url": "", "changes": {"funds": i % 500, "morale": -5, "risk": 3}}
+
+def make_record(i):
+    return HistoryEvent(f"イベント{i}", "郭嘉が新たな戦略を策定した。", "郭嘉", "", {"funds": i % 500, "morale": -5, "risk": 3}, 1770529759 + i)
+
+def measure_build(factory):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    items = [factory(i) for i in range(N)]
+    elapsed = time.perf_counter() - t0
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return items, size, elapsed
+
+def measure(label, fn):
+    t0 = time.perf_counter()
+    out = fn()
+    print(f"  {label:<28} {time.perf_counter() - t0:7.3f}s  {len(out.encode('utf-8')) / 1e6:7.2f}MB")
+
+if __name__ == "__main__":
+    print(f"--- 📏 {N}件のイベント ---")
+    dicts, dict_mem, dict_t = measure_build(make_dict)
+    records, rec_mem, rec_t = measure_build(make_record)
+    print(f"  dict     : メモリ {dict_mem / 1e6:7.2f}MB  生成 {dict_t:.3f}s")
+    print(f"  record   : メモリ {rec_mem / 1e6:7.2f}MB  生成 {rec_t:.3f}s")
+    print("--- ⏱️ シリアライズ ---")
+    # エンコーダの差とレコード型の差を分けて見るため、dict 側も同じエンコーダで測る
+    measure("dict json.dumps(indent=2)", lambda: json.dumps(dicts, indent=2, ensure_ascii=False))
+    measure("dict dumps_pretty", lambda: dumps_pretty(dicts))
+    measure("dict dumps_compact", lambda: dumps_compact(dicts))
+    measure("record dumps_pretty", lambda: dumps_pretty([r.to_dict() for r in records]))
+    measure("record dumps_compact", lambda: dumps_compact([r.to_dict() for r in records]))
@@ -0,0 +1,61 @@
+# src/deadline.py
+import time
+import threading
+from collections import deque, Counter
+
+# --- ⏳ デッドライン ---
+# 1ティック（定例イベント / 介入1件）全体の締め切りと、LLM呼び出し1回ごとの締め切りを持つ。
+# 超過したら生成をトークン境界で打ち切り、呼び出し側はキャッシュかテンプレートに切り替える。
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.at = time.monotonic() + seconds
+        self.missed = False  # 超過をもう記録したか（ティック単位で1回だけ数える）
+
+    def remaining(self):
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.at
+
+    def within(self, seconds):
+        """seconds 後と自分の締め切りの早い方"""
+        d = Deadline(seconds)
+        d.at = min(d.at, self.at)
+        return d
+
+
+class DeadlineStats:
+    """締め切り超過回数とティック所要時間の記録"""
+
+    def __init__(self, window=200):
+        self.misses = Counter()
+        self.ticks = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def miss(self, kind):
+        with self.lock:
+            self.misses[kind] += 1
+
+    def miss_tick(self, deadline):
+        """ティックの締め切り超過を、そのティックにつき1回だけ数える"""
+        if deadline is None or deadline.missed or not deadline.expired(): return
+        deadline.missed = True
+        self.miss("tick")
+
+    def tick(self, seconds):
+        with self.lock:
+            self.ticks.append(seconds)
+
+    def percentile(self, p):
+        with self.lock:
+            if not self.ticks: return 0.0
+            ordered = sorted(self.ticks)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def snapshot(self):
+        with self.lock:
+            misses = dict(self.misses)
+            count = len(self.ticks)
+        return {"misses": misses, "ticks": count, "tick_p50": round(self.percentile(0.5), 2), "tick_p99": round(self.percentile(0.99), 2)}
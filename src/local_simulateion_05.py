@@ -6,6 +6,7 @@ import random
 import threading
 import re
 import urllib.request # タイムアウト付き通信用
+import urllib.parse
 import feedparser
 import subprocess # Git操作用
 from http.server import HTTPServer, SimpleHTTPRequestHandler
@@ -13,20 +14,40 @@ from llama_cpp import Llama
 
 # 設定ファイル読み込み
 try:
-    from settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, PORT, SLEEP_TIME
+    from settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, ARCHIVE_FILE, PORT, SLEEP_TIME
+    from settings import ACTION_RATE_PER_CLIENT, ACTION_BURST_PER_CLIENT, ACTION_RATE_GLOBAL, ACTION_BURST_GLOBAL, MAX_PENDING_REQUESTS
+    from settings import LLAMA_PARAMS, POSTS_FILE, THREADS_FILE, TICK_DEADLINE_SEC, CALL_DEADLINE_SEC, NEWS_TIMEOUT_SEC
+    from deadline import Deadline, DeadlineStats
+    from admission import AdmissionController
+    from search import SearchIndex
+    from prompts import EVENT_MAX_TOKENS, SHORT_MAX_TOKENS, news_context_for, event_messages, comment_messages, sns_messages
+    from records import CompanyState, HistoryEvent, Tweet, load_history, dump_history, dumps_pretty, dumps_compact, archive_line, safe_int
 except ImportError:
-    from src.settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, PORT, SLEEP_TIME
+    from src.settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, ARCHIVE_FILE, PORT, SLEEP_TIME
+    from src.settings import ACTION_RATE_PER_CLIENT, ACTION_BURST_PER_CLIENT, ACTION_RATE_GLOBAL, ACTION_BURST_GLOBAL, MAX_PENDING_REQUESTS
+    from src.settings import LLAMA_PARAMS, POSTS_FILE, THREADS_FILE, TICK_DEADLINE_SEC, CALL_DEADLINE_SEC, NEWS_TIMEOUT_SEC
+    from src.deadline import Deadline, DeadlineStats
+    from src.admission import AdmissionController
+    from src.search import SearchIndex
+    from src.prompts import EVENT_MAX_TOKENS, SHORT_MAX_TOKENS, news_context_for, event_messages, comment_messages, sns_messages
+    from src.records import CompanyState, HistoryEvent, Tweet, load_history, dump_history, dumps_pretty, dumps_compact, archive_line, safe_int
 
 print(f"--- 🏰 魏ホールディングス Stability & Auto-Push版 ({MODEL_PATH}) ---")
 
 # --- 🔒 ロック & フラグ定義 ---
-data_lock = threading.Lock()   # ファイル読み書き用
+data_lock = threading.RLock()  # ファイル読み書き用（ロック内から load/save を呼ぶため再入可）
 model_lock = threading.Lock()  # AIモデル生成用
 reset_event = threading.Event() # リセット発生通知用
+reset_generation = 0            # リセット回数（介入ワーカーが処理中にリセットされたかの判定用）
+search_index = SearchIndex.rebuild(ARCHIVE_FILE, HISTORY_FILE, DATA_FILE, POSTS_FILE, THREADS_FILE)  # 起動時にアーカイブから再構築
+deadline_stats = DeadlineStats()  # 締め切り超過回数・ティック所要時間
+admission = AdmissionController(ACTION_RATE_PER_CLIENT, ACTION_BURST_PER_CLIENT, ACTION_RATE_GLOBAL, ACTION_BURST_GLOBAL, MAX_PENDING_REQUESTS)
 
 # --- 🤖 モデルロード ---
+# n_ctx / n_threads / n_batch / n_gpu_layers は tune_llama.py が書き出したホスト別プロファイルから読む
 try:
-    llm = Llama(model_path=MODEL_PATH, n_gpu_layers=25, n_ctx=4096, verbose=False)
+    llm = Llama(model_path=MODEL_PATH, verbose=False, **LLAMA_PARAMS)
+    print(f"⚙️ llama.cpp: {LLAMA_PARAMS}")
     print("✅ Qwen2.5 起動完了")
 except Exception as e:
     print(f"❌ モデルエラー: {e}")
@@ -42,8 +63,19 @@ def load_json_safe(path, default_data):
 
 def save_json_safe(path, data):
     with data_lock:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        write_dashboard(path, data)
+
+def write_dashboard(path, data):
+    """ダッシュボード用JSONの書き込み（呼び出し側で data_lock を持つこと）"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dumps_pretty(data))
+
+def append_archive(entries):
+    """(kind, record) をコンパクトJSONLでアーカイブへ追記し、検索インデックスにも反映（呼び出し側で data_lock を持つこと）"""
+    if not entries: return
+    with open(ARCHIVE_FILE, "a", encoding="utf-8") as f:
+        f.writelines(archive_line(kind, r) for kind, r in entries)
+    search_index.load_archive(ARCHIVE_FILE)  # 追記分をそのまま索引へ
 
 def extract_json(text):
     try:
@@ -57,18 +89,21 @@ def extract_json(text):
     except: pass
     return None
 
-def chat_generate(messages, max_tokens=200):
-    with model_lock:
-        try:
-            response = llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0.8)
-            return response['choices'][0]['message']['content'].strip()
-        except: return ""
-
-def safe_int(val):
+def chat_generate(messages, max_tokens=200, deadline=None):
+    """締め切り（ティック全体と1回ごとの早い方）を過ぎたらトークン境界で打ち切り、None を返す"""
+    call = deadline.within(CALL_DEADLINE_SEC) if deadline else Deadline(CALL_DEADLINE_SEC)
+    if not model_lock.acquire(timeout=call.remaining()):
+        deadline_stats.miss("model_lock"); deadline_stats.miss_tick(deadline); return None
     try:
-        clean_val = str(val).replace(",", "").replace("+", "").replace(" ", "")
-        return int(float(clean_val))
-    except: return 0
+        chunks = []
+        for chunk in llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0.8, stream=True):
+            if call.expired():
+                deadline_stats.miss("generate"); deadline_stats.miss_tick(deadline); print("⏳ 生成打ち切り（締め切り超過）")
+                return None
+            chunks.append(chunk['choices'][0]['delta'].get('content') or "")
+        return "".join(chunks).strip()
+    except: return ""
+    finally: model_lock.release()
 
 # --- 📤 GitHub送信関数 ---
 def git_push_result():
@@ -92,13 +127,15 @@ def git_push_result():
         print(f"⚠️ 予期せぬGitエラー: {e}")
 
 # --- 📰 ニュース取得 ---
-def get_ai_news():
+def get_ai_news(deadline=None):
     if random.random() > 0.4: return None
+    timeout = min(NEWS_TIMEOUT_SEC, deadline.remaining()) if deadline else NEWS_TIMEOUT_SEC
+    if timeout <= 0: deadline_stats.miss("news"); return None
     # rss_url = "https://news.google.com/rss/search?q=AI技術+when:1d&hl=ja&gl=JP&ceid=JP:ja"
     query = urllib.parse.quote("AI技術")
     rss_url = f"https://news.google.com/rss/search?q={query}+when:1d&hl=ja&gl=JP&ceid=JP:ja"
     try:
-        with urllib.request.urlopen(rss_url, timeout=5) as response:
+        with urllib.request.urlopen(rss_url, timeout=timeout) as response:
             xml = response.read()
             feed = feedparser.parse(xml)
             if feed.entries:
@@ -110,40 +147,27 @@ def get_ai_news():
 
 # --- 📊 経営評価 ---
 def evaluate_status(state):
-    f = safe_int(state['funds'])
-    risk = safe_int(state['risk'])
-    morale = safe_int(state['morale'])
-    
-    if risk > 60: state['reputation'] = "炎上中🔥"; state['rating'] = "危険"
-    elif morale < 30: state['reputation'] = "ブラック"; state['rating'] = "悪化"
-    elif f > 5000: state['reputation'] = "優良企業"; state['rating'] = "安泰"
-    else: state['reputation'] = "様子見"; state['rating'] = "安定"
+    if state.risk > 60: state.reputation = "炎上中🔥"; state.rating = "危険"
+    elif state.morale < 30: state.reputation = "ブラック"; state.rating = "悪化"
+    elif state.funds > 5000: state.reputation = "優良企業"; state.rating = "安泰"
+    else: state.reputation = "様子見"; state.rating = "安定"
     return state
 
 # --- 🧠 生成ロジック群 ---
-def generate_event(state):
+def generate_event(state, deadline=None):
     print("🎲 イベント生成中...")
-    news = get_ai_news()
-    news_context = ""
+    news = get_ai_news(deadline)
     news_url = ""
 
     if news:
         print(f"📰 News採用: {news['title']}")
-        news_context = f"【ニュース記事】\nタイトル: {news['title']}\n概要: {news['summary']}\n\nこのニュースを利用して、魏がとった施策を考案せよ。"
         news_url = news['link']
     else:
         print("🏢 社内イベント生成")
-        news_context = "社内の出来事（派閥争い、突飛な新規事業、宴会、トラブル等）を作成せよ。"
-
-    situation = f"資金{state['funds']}、士気{state['morale']}、リスク{state['risk']}"
-    members_str = ", ".join(CHARACTERS.keys())
 
-    messages = [
-        {"role": "system", "content": f"あなたは魏のGM。メンバー({members_str})から1名を選び、JSONでイベント作成せよ。項目:title, proposer, description, changes(funds, morale, risk)"},
-        {"role": "user", "content": f"状況: {situation}\n{news_context}"}
-    ]
+    messages = event_messages(state, news_context_for(news))
 
-    data = extract_json(chat_generate(messages, max_tokens=500))
+    data = extract_json(chat_generate(messages, max_tokens=EVENT_MAX_TOKENS, deadline=deadline) or "")
     if data and "changes" in data:
         if data.get('proposer') not in CHARACTERS: data['proposer'] = "曹操"
         data['news_url'] = news_url
@@ -152,7 +176,7 @@ def generate_event(state):
 
 # local_simulateion_05.py の generate_intervention 関数を修正
 
-def generate_intervention(action_type, state):
+def generate_intervention(action_type, state, deadline=None):
     print(f"⚡ 介入イベント生成中: {action_type}")
     
     # 指示を具体化し、JSON形式を厳守させる
@@ -178,7 +202,7 @@ def generate_intervention(action_type, state):
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": "今すぐ生成せよ"}]
     
     # 生成実行
-    data = extract_json(chat_generate(messages, max_tokens=500))
+    data = extract_json(chat_generate(messages, max_tokens=EVENT_MAX_TOKENS, deadline=deadline) or "")
     
     if data and "changes" in data:
         data['proposer'] = "天の声"
@@ -196,32 +220,38 @@ def generate_intervention(action_type, state):
     print("⚠️ JSON生成失敗。エラーログを記録します。")
     return {"title": "通信エラー", "description": "天の声が届かなかったようだ...（再試行してください）", "proposer": "システム", "changes": {}}
 
-def update_ministers_comments(state, event_data):
+def update_ministers_comments(state, event_data, deadline=None):
     print("💬 武将コメント...")
     new_comments = {}
     for name, char_data in CHARACTERS.items():
         stance = random.choice(char_data['bias'])
-        messages = [
-            {"role": "system", "content": f"あなたは{name}。{char_data['style']} スタンス:{stance}。ネットスラング等を使い20文字以内で発言せよ。"},
-            {"role": "user", "content": f"イベント: {event_data['title']}\n詳細: {event_data['description']}"}
-        ]
-        text = chat_generate(messages, max_tokens=60).replace("「", "").replace("」", "")
-        new_comments[name] = text
+        if deadline and deadline.expired():
+            text = None; deadline_stats.miss("skipped_call"); deadline_stats.miss_tick(deadline)
+        else:
+            text = chat_generate(comment_messages(name, char_data, stance, event_data), max_tokens=SHORT_MAX_TOKENS, deadline=deadline)
+        # 締め切り超過時は前回のコメントを使い回す（無ければスタンスだけ）
+        if text is None: text = state.comments.get(name) or f"（{stance}）"
+        new_comments[name] = text.replace("「", "").replace("」", "")
     return new_comments
 
-def generate_sns_reactions(event_data, current_sns_log, comments):
+def merge_comments(current, generated, snapshot):
+    """生成したコメントのうち、読み出し時点から変わったもの（=今回生成できたもの）だけを current に重ねる"""
+    return {**current, **{k: v for k, v in generated.items() if v != snapshot.get(k)}}
+
+def generate_sns_reactions(event_data, current_sns_log, comments, deadline=None):
     print("📱 SNS反応...")
     targets = random.sample(MOBS, 3)
     if random.random() < 0.3: targets.append(random.choice(RIVALS))
     
     new_tweets = []
     for user in targets:
-        messages = [
-            {"role": "system", "content": f"あなたはSNSユーザー「{user['name']}」。ネットのノリで30文字以内で書け。"},
-            {"role": "user", "content": f"話題: {event_data['description'] if event_data else '最近の魏について'}"}
-        ]
-        text = chat_generate(messages, max_tokens=60).replace("「", "").replace("」", "")
-        new_tweets.append({"name": user['name'], "id": user['id'], "content": text, "is_vip": user in RIVALS, "timestamp": datetime.datetime.now().strftime("%H:%M")})
+        if deadline and deadline.expired():
+            text = None; deadline_stats.miss("skipped_call"); deadline_stats.miss_tick(deadline)
+        else:
+            text = chat_generate(sns_messages(user, event_data), max_tokens=SHORT_MAX_TOKENS, deadline=deadline)
+        # 締め切り超過時はそのユーザーは今回は投稿しない（タイムラインは前回のまま残る）
+        if text is None: continue
+        new_tweets.append(Tweet(user['name'], user['id'], text.replace("「", "").replace("」", ""), user in RIVALS))
     
     return (new_tweets + current_sns_log)[:30]
 
@@ -230,7 +260,7 @@ def simulation_loop():
     os.makedirs("./data", exist_ok=True)
     if not os.path.exists(DATA_FILE): save_json_safe(DATA_FILE, INITIAL_STATE)
     if not os.path.exists(HISTORY_FILE): 
-        save_json_safe(HISTORY_FILE, [{"timestamp": datetime.datetime.now().strftime("%H:%M"), "title": "魏創業", "description": "システム稼働。", "proposer": "システム", "changes": {}}])
+        save_json_safe(HISTORY_FILE, [HistoryEvent("魏創業", "システム稼働。", "システム").to_dict()])
 
     # ★ 追加：起動直後に一度強制的に送信して、404エラー（真っ白）を防ぐ
     print("🚀 初回データを同期中...")
@@ -246,7 +276,9 @@ def simulation_loop():
         subprocess.run(["git", "pull", "origin", "main"], check=False)
 
         # A. 現状読み込み
-        state_snapshot = load_json_safe(DATA_FILE, INITIAL_STATE)
+        tick_started = time.monotonic()
+        deadline = Deadline(TICK_DEADLINE_SEC)
+        state_snapshot = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
         
         # ★ トリガーファイルの読み込み（例: data/trigger.json）
         trigger_data = load_json_safe("data/trigger.json", {"action": None})
@@ -256,15 +288,16 @@ def simulation_loop():
             # ボタンが押されていた場合：介入イベントを生成
             action = trigger_data["action"]
             print(f"⚡ 介入検知 ({action}): 専用イベントを生成します")
-            event_data = generate_intervention(action, state_snapshot)
+            event_data = generate_intervention(action, state_snapshot, deadline)
             # 処理が終わったのでトリガーをクリア（重要！）
             save_json_safe("data/trigger.json", {"action": None})
         else:
             # 通常時：1時間おきの定例イベントを生成
-            event_data = generate_event(state_snapshot)
+            event_data = generate_event(state_snapshot, deadline)
 
-        comments = update_ministers_comments(state_snapshot, event_data)
-        sns_log = generate_sns_reactions(event_data, state_snapshot.get('sns', []), comments)
+        comments = update_ministers_comments(state_snapshot, event_data, deadline)
+        sns_log = generate_sns_reactions(event_data, state_snapshot.sns, comments, deadline)
+        deadline_stats.tick(time.monotonic() - tick_started)
 
         if reset_event.is_set():
             reset_event.clear(); continue
@@ -272,25 +305,26 @@ def simulation_loop():
         # C. 書き込み
         with data_lock:
             try:
-                with open(DATA_FILE, "r", encoding="utf-8") as f: current_state = json.load(f)
-                with open(HISTORY_FILE, "r", encoding="utf-8") as f: current_history = json.load(f)
+                with open(DATA_FILE, "r", encoding="utf-8") as f: current_state = CompanyState.from_dict(json.load(f))
+                with open(HISTORY_FILE, "r", encoding="utf-8") as f: current_history = load_history(json.load(f))
             except:
                 current_state = state_snapshot; current_history = []
 
-            changes = event_data['changes']
-            current_state['funds'] += safe_int(changes.get('funds', 0))
-            current_state['morale'] += safe_int(changes.get('morale', 0))
-            current_state['risk'] += safe_int(changes.get('risk', 0))
+            # LLM出力はここで一度だけ検証・型変換する
+            log_entry = HistoryEvent.from_dict({**event_data, "timestamp": None})
+            current_state.apply(log_entry.changes)
             current_state = evaluate_status(current_state)
-            current_state['comments'] = comments
-            current_state['sns'] = sns_log 
+            # 生成中に介入ワーカーが書いた分を潰さないよう、このティックで増えた分だけ重ねる
+            current_state.comments = merge_comments(current_state.comments, comments, state_snapshot.comments)
+            new_sns = [t for t in sns_log if t not in state_snapshot.sns]
+            current_state.sns = (new_sns + current_state.sns)[:30]
 
-            log_entry = {"timestamp": datetime.datetime.now().strftime("%H:%M"), "title": event_data['title'], "description": event_data['description'], "proposer": event_data.get("proposer"), "news_url": event_data.get("news_url", ""), "changes": changes}
             current_history.insert(0, log_entry)
             if len(current_history) > 30: current_history.pop()
 
-            with open(DATA_FILE, "w", encoding="utf-8") as f: json.dump(current_state, f, indent=2, ensure_ascii=False)
-            with open(HISTORY_FILE, "w", encoding="utf-8") as f: json.dump(current_history, f, indent=2, ensure_ascii=False)
+            write_dashboard(DATA_FILE, current_state.to_dict())
+            write_dashboard(HISTORY_FILE, dump_history(current_history))
+            append_archive([("event", log_entry)] + [("tweet", t) for t in new_sns])
 
             # --- 💾 自動送信 (判定を甘くして確実に送る) ---
             
@@ -304,60 +338,107 @@ def simulation_loop():
 
             subprocess.run(["git", "push", "origin", "main"], check=False)
         
+        print(f"⏱️ 生成 p50={deadline_stats.percentile(0.5):.1f}s p99={deadline_stats.percentile(0.99):.1f}s 超過={dict(deadline_stats.misses)}")
         print(f"✅ 更新完了。次の更新まで {SLEEP_TIME // 60} 分待機します。")
 
         time.sleep(SLEEP_TIME)
 
+# --- ⚡ 介入ワーカー ---
+def run_intervention(action_type):
+    started = time.monotonic()
+    deadline = Deadline(TICK_DEADLINE_SEC)
+    generation = reset_generation
+    state_snapshot = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
+    event_data = generate_intervention(action_type, state_snapshot, deadline)
+    comments = update_ministers_comments(state_snapshot, event_data, deadline)
+    sns_log = generate_sns_reactions(event_data, state_snapshot.sns, comments, deadline)
+    deadline_stats.tick(time.monotonic() - started)  # 定例ティックと同じく生成部分だけを計る
+    
+    with data_lock:
+        # 生成中にリセットされた場合だけ捨てる（リセット後に受け付けた介入は反映する）
+        if reset_generation != generation: return
+        
+        state = CompanyState.from_dict(load_json_safe(DATA_FILE, INITIAL_STATE))
+        history = load_history(load_json_safe(HISTORY_FILE, []))
+        
+        log_entry = HistoryEvent.from_dict({**event_data, "proposer": "天の声", "news_url": "", "timestamp": None})
+        state.apply(log_entry.changes)
+        state = evaluate_status(state)
+        state.comments = merge_comments(state.comments, comments, state_snapshot.comments)
+        old_sns = state.sns
+        # 生成中に他の書き込みで増えたタイムラインを消さないよう、新規分だけ先頭に足す
+        state.sns = ([t for t in sns_log if t not in state_snapshot.sns] + old_sns)[:30]
+
+        history.insert(0, log_entry)
+        if len(history) > 30: history.pop()
+
+        write_dashboard(DATA_FILE, state.to_dict())
+        write_dashboard(HISTORY_FILE, dump_history(history))
+        append_archive([("event", log_entry)] + [("tweet", t) for t in state.sns if t not in old_sns])
+        
+        # --- 💾 自動送信 (介入イベント版) ---
+        git_push_result()
+
+def intervention_worker():
+    """受け付けた介入を1件ずつ処理する（同時に走るLLMパイプラインは常に1本）"""
+    while True:
+        action_type = admission.next_action()
+        started = time.monotonic()
+        try: run_intervention(action_type)
+        except Exception as e: print(f"Error: {e}")
+        finally: admission.done(time.monotonic() - started)
+
 # --- 🌍 Webサーバー ---
 class CustomHandler(SimpleHTTPRequestHandler):
     def end_headers(self):
         self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
         super().end_headers()
 
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/api/stats': return self.send_json({"deadline": deadline_stats.snapshot(), "admission": admission.snapshot()})
+        if url.path != '/api/search': return super().do_GET()
+
+        qs = urllib.parse.parse_qs(url.query)
+        arg = lambda k, d="": qs.get(k, [d])[0]
+        search_index.load_archive(ARCHIVE_FILE)  # 他プロセス（data/main.py 等）の追記分
+        search_index.refresh_board(POSTS_FILE, THREADS_FILE)
+        result = search_index.search(arg('q'), kind=arg('type') or None, user=arg('user') or None,
+                                     page=max(safe_int(arg('page', 1)), 1), per_page=min(max(safe_int(arg('per_page', 20)), 1), 100))
+        self.send_json(result)
+
+    def send_json(self, data):
+        body = dumps_compact(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
     def do_POST(self):
+        global reset_generation
         action_type = self.path.split('/')[-1]
         try:
             if action_type == 'reset':
                 with data_lock:
-                    save_json_safe(DATA_FILE, INITIAL_STATE.copy())
-                    save_json_safe(HISTORY_FILE, [{"timestamp": datetime.datetime.now().strftime("%H:%M"), "title": "リセット", "description": "無に帰した。", "proposer": "システム", "changes": {}}])
-                    reset_event.set()
+                    write_dashboard(DATA_FILE, INITIAL_STATE.copy())
+                    write_dashboard(HISTORY_FILE, [HistoryEvent("リセット", "無に帰した。", "システム").to_dict()])
+                    reset_event.set(); reset_generation += 1
+                admission.clear()
                 self.send_response(200); self.end_headers(); self.wfile.write(b'OK'); return
 
             if action_type in ['edict', 'audit', 'rumor']:
-                state_snapshot = load_json_safe(DATA_FILE, INITIAL_STATE)
-                event_data = generate_intervention(action_type, state_snapshot)
-                comments = update_ministers_comments(state_snapshot, event_data)
-                
-                with data_lock:
-                    if reset_event.is_set(): self.send_response(200); self.end_headers(); return
-                    
-                    state = load_json_safe(DATA_FILE, INITIAL_STATE)
-                    history = load_json_safe(HISTORY_FILE, [])
-                    
-                    changes = event_data['changes']
-                    state['funds'] += safe_int(changes.get('funds', 0))
-                    state['morale'] += safe_int(changes.get('morale', 0))
-                    state['risk'] += safe_int(changes.get('risk', 0))
-                    state = evaluate_status(state); state['comments'] = comments
-                    state['sns'] = generate_sns_reactions(event_data, state.get('sns', []), comments)
-
-                    log_entry = {"timestamp": datetime.datetime.now().strftime("%H:%M"), "title": event_data['title'], "description": event_data['description'], "proposer": "天の声", "news_url": "", "changes": changes}
-                    history.insert(0, log_entry)
-                    if len(history) > 30: history.pop()
-
-                    with open(DATA_FILE, "w", encoding="utf-8") as f: json.dump(state, f, indent=2, ensure_ascii=False)
-                    with open(HISTORY_FILE, "w", encoding="utf-8") as f: json.dump(history, f, indent=2, ensure_ascii=False)
-                    
-                    # --- 💾 自動送信 (介入イベント版) ---
-                    git_push_result()
-
-                self.send_response(200); self.end_headers(); self.wfile.write(b'OK'); return
-            self.send_response(400)
+                status, retry_after, merged = admission.admit(self.client_address[0], action_type)
+                if status in ("rate_limited", "queue_full"):
+                    print(f"🚦 介入を拒否 ({action_type}, {status}, {retry_after}s)")
+                    self.send_response(429); self.send_header('Retry-After', str(retry_after))
+                    self.end_headers(); self.wfile.write(status.encode()); return
+                self.send_response(202); self.end_headers(); self.wfile.write(b'MERGED' if merged else b'QUEUED'); return
+            self.send_response(400); self.end_headers()
         except Exception as e:
-            print(f"Error: {e}"); self.send_response(500)
+            print(f"Error: {e}"); self.send_response(500); self.end_headers()
 
 if __name__ == "__main__":
     t_server = threading.Thread(target=lambda: HTTPServer(('0.0.0.0', PORT), CustomHandler).serve_forever(), daemon=True)
     t_server.start()
+    threading.Thread(target=intervention_worker, daemon=True).start()
     simulation_loop()
\ No newline at end of file
@@ -0,0 +1,34 @@
+# src/prompts.py
+# LLMに渡すプロンプトの組み立て。シミュレーション本体とチューナー(tune_llama.py)で共用する。
+try:
+    from settings import CHARACTERS
+except ImportError:
+    from src.settings import CHARACTERS
+
+EVENT_MAX_TOKENS = 500  # イベント・介入（JSON出力）
+SHORT_MAX_TOKENS = 60   # 武将コメント・SNS
+
+def news_context_for(news):
+    if news:
+        return f"【ニュース記事】\nタイトル: {news['title']}\n概要: {news['summary']}\n\nこのニュースを利用して、魏がとった施策を考案せよ。"
+    return "社内の出来事（派閥争い、突飛な新規事業、宴会、トラブル等）を作成せよ。"
+
+def event_messages(state, news_context):
+    situation = f"資金{state.funds}、士気{state.morale}、リスク{state.risk}"
+    members_str = ", ".join(CHARACTERS.keys())
+    return [
+        {"role": "system", "content": f"あなたは魏のGM。メンバー({members_str})から1名を選び、JSONでイベント作成せよ。項目:title, proposer, description, changes(funds, morale, risk)"},
+        {"role": "user", "content": f"状況: {situation}\n{news_context}"}
+    ]
+
+def comment_messages(name, char_data, stance, event_data):
+    return [
+        {"role": "system", "content": f"あなたは{name}。{char_data['style']} スタンス:{stance}。ネットスラング等を使い20文字以内で発言せよ。"},
+        {"role": "user", "content": f"イベント: {event_data['title']}\n詳細: {event_data['description']}"}
+    ]
+
+def sns_messages(user, event_data):
+    return [
+        {"role": "system", "content": f"あなたはSNSユーザー「{user['name']}」。ネットのノリで30文字以内で書け。"},
+        {"role": "user", "content": f"話題: {event_data['description'] if event_data else '最近の魏について'}"}
+    ]
@@ -0,0 +1,133 @@
+# src/records.py
+import json
+import time
+import datetime
+from dataclasses import dataclass, field
+
+# --- 🧾 レコード型 ---
+# dict の代わりに __slots__ 付きの dataclass で保持する。
+# 入力の検証・型変換は from_dict（境界）で一度だけ行い、以降は信頼して使う。
+# timestamp はエポック秒（int）。旧形式の "%H:%M" 文字列も読み込み時に変換する。
+
+def safe_int(val):
+    try:
+        clean_val = str(val).replace(",", "").replace("+", "").replace(" ", "")
+        return int(float(clean_val))
+    except: return 0
+
+def now_ts():
+    return int(time.time())
+
+def to_epoch(val):
+    """エポック秒 / "%Y-%m-%d %H:%M:%S" / 旧形式 "%H:%M" をエポック秒に変換"""
+    if isinstance(val, (int, float)) and not isinstance(val, bool): return int(val)
+    if isinstance(val, str):
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+            try: return int(datetime.datetime.strptime(val, fmt).timestamp())
+            except ValueError: pass
+        try:
+            # 日付を持たない旧形式は「今日のその時刻」とみなす（未来なら前日）
+            t = datetime.datetime.strptime(val, "%H:%M").time()
+            now = datetime.datetime.now()
+            dt = datetime.datetime.combine(now.date(), t)
+            if dt > now: dt -= datetime.timedelta(days=1)
+            return int(dt.timestamp())
+        except ValueError: pass
+    return now_ts()
+
+def _changes(val):
+    if not isinstance(val, dict): return {}
+    return {k: safe_int(v) for k, v in val.items() if k in ("funds", "morale", "risk")}
+
+
+@dataclass(slots=True)
+class Tweet:
+    name: str
+    id: str
+    content: str
+    is_vip: bool = False
+    timestamp: int = field(default_factory=now_ts)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(str(d.get("name", "")), str(d.get("id", "")), str(d.get("content", "")),
+                   bool(d.get("is_vip", False)), to_epoch(d.get("timestamp")))
+
+    def to_dict(self):
+        return {"name": self.name, "id": self.id, "content": self.content, "is_vip": self.is_vip, "timestamp": self.timestamp}
+
+
+@dataclass(slots=True)
+class HistoryEvent:
+    title: str
+    description: str
+    proposer: str = "不明"
+    news_url: str = ""
+    changes: dict = field(default_factory=dict)
+    timestamp: int = field(default_factory=now_ts)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(str(d.get("title", "")), str(d.get("description", "")), str(d.get("proposer") or "不明"),
+                   str(d.get("news_url") or ""), _changes(d.get("changes")), to_epoch(d.get("timestamp")))
+
+    def to_dict(self):
+        return {"timestamp": self.timestamp, "title": self.title, "description": self.description,
+                "proposer": self.proposer, "news_url": self.news_url, "changes": self.changes}
+
+
+@dataclass(slots=True)
+class CompanyState:
+    funds: int = 0
+    morale: int = 0
+    risk: int = 0
+    rating: str = ""
+    reputation: str = ""
+    comments: dict = field(default_factory=dict)
+    sns: list = field(default_factory=list)  # list[Tweet]
+
+    @classmethod
+    def from_dict(cls, d):
+        if not isinstance(d, dict): d = {}
+        comments = d.get("comments")
+        sns = d.get("sns")
+        return cls(safe_int(d.get("funds", 0)), safe_int(d.get("morale", 0)), safe_int(d.get("risk", 0)),
+                   str(d.get("rating", "")), str(d.get("reputation", "")),
+                   {str(k): str(v) for k, v in comments.items()} if isinstance(comments, dict) else {},
+                   [Tweet.from_dict(t) for t in sns if isinstance(t, dict)] if isinstance(sns, list) else [])
+
+    def to_dict(self):
+        return {"funds": self.funds, "morale": self.morale, "risk": self.risk, "rating": self.rating,
+                "reputation": self.reputation, "comments": self.comments, "sns": [t.to_dict() for t in self.sns]}
+
+    def apply(self, changes):
+        self.funds += changes.get("funds", 0)
+        self.morale += changes.get("morale", 0)
+        self.risk += changes.get("risk", 0)
+
+
+def load_history(raw):
+    if not isinstance(raw, list): return []
+    return [HistoryEvent.from_dict(d) for d in raw if isinstance(d, dict)]
+
+def dump_history(history):
+    return [e.to_dict() for e in history]
+
+# --- ⚡ エンコーダ ---
+# エンコーダは使い回す。indent なしの場合は C 実装の高速パスが使われる。
+_compact_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+_pretty_encoder = json.JSONEncoder(ensure_ascii=False, indent=2)
+
+def dumps_compact(obj):
+    """保存用：空白なしのコンパクトJSON"""
+    return _compact_encoder.encode(obj)
+
+def dumps_pretty(obj):
+    """ダッシュボード用：インデント付きJSON"""
+    return _pretty_encoder.encode(obj)
+
+def archive_line(kind, record):
+    """アーカイブ(JSONL)の1行。kind は "event" / "tweet" など"""
+    d = record.to_dict()
+    d["type"] = kind
+    return dumps_compact(d) + "\n"
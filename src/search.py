@@ -0,0 +1,201 @@
+# src/search.py
+import os
+import json
+import time
+import heapq
+import bisect
+import threading
+import unicodedata
+from array import array
+
+try:
+    from records import to_epoch
+except ImportError:
+    from src.records import to_epoch
+
+# --- 🔎 全文検索 ---
+# 日本語は単語境界が無いので、文字 uni-gram + bi-gram の転置インデックスで引く。
+#   - ポスティングは doc_id 昇順の array（追記のみ）。AND 検索は最短リストを起点に集合演算で絞る
+#   - 3文字以上のクエリは候補を本文の部分一致で確認する
+#   - 結果は timestamp の新しい順（関連度スコアは持たない）
+#   - 追加はインクリメンタル。アーカイブ(JSONL)と掲示板JSONから丸ごと作り直すこともできる
+
+N = 2
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+def grams(text):
+    """bi-gram の集合（1文字ならその文字）"""
+    if len(text) < N: return {text} if text else set()
+    return {text[i:i + N] for i in range(len(text) - N + 1)}
+
+def index_terms(text):
+    """索引に載せる語：1文字クエリ用の uni-gram + bi-gram"""
+    return set(text) | grams(text)
+
+
+class SearchIndex:
+    def __init__(self):
+        # doc_id で引く列指向の格納（doc_id は追加順）
+        self.kinds = []
+        self.users = []
+        self.timestamps = array("q")
+        self.texts = []      # 正規化済み本文
+        self.payloads = []
+        self.order_ts = array("q")   # timestamp 昇順に並べた (timestamp, doc_id)
+        self.order_ids = array("I")
+        self.postings = {}   # uni-gram / bi-gram -> array('I') of doc_id
+        self.by_kind = {}    # type -> set(doc_id)
+        self.by_user = {}    # 名前 / @ID -> set(doc_id)
+        self.seen = set()    # 重複登録防止キー（本文はハッシュだけ持つ）
+        self.archive_offset = 0
+        self.file_mtimes = {}
+        self.lock = threading.Lock()
+        self.tail_lock = threading.Lock()  # load_archive 全体（読み位置の更新込み）を直列化する。add は self.lock を取る
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, kind, users, timestamp, text, payload, key=None):
+        """1件追加。key が登録済みなら何もしない"""
+        key = key or (kind, timestamp, users, hash(text))
+        with self.lock:
+            if key in self.seen: return
+            self.seen.add(key)
+            doc_id = len(self.texts)
+            text = normalize(text)
+            self.kinds.append(kind); self.users.append(users); self.timestamps.append(timestamp)
+            self.texts.append(text); self.payloads.append(payload)
+            if not self.order_ts or timestamp >= self.order_ts[-1]:
+                self.order_ts.append(timestamp); self.order_ids.append(doc_id)
+            else:
+                # 古い日付の後追い登録（旧データ・掲示板）はまれなので挿入で済ませる
+                pos = bisect.bisect_right(self.order_ts, timestamp)
+                self.order_ts.insert(pos, timestamp); self.order_ids.insert(pos, doc_id)
+            self.by_kind.setdefault(kind, set()).add(doc_id)
+            for u in users:
+                if u: self.by_user.setdefault(u, set()).add(doc_id)
+            for g in index_terms(text):
+                posting = self.postings.get(g)
+                if posting is None: posting = self.postings[g] = array("I")
+                posting.append(doc_id)
+
+    # --- 取り込み（レコード種別ごと） ---
+    def add_event(self, d):
+        self.add("event", (d.get("proposer", ""),), to_epoch(d.get("timestamp")),
+                 f"{d.get('title', '')}\n{d.get('description', '')}", d)
+
+    def add_tweet(self, d):
+        self.add("tweet", (d.get("name", ""), d.get("id", "")), to_epoch(d.get("timestamp")), d.get("content", ""), d)
+
+    def add_post(self, d):
+        self.add("post", (d.get("name", ""), d.get("user_id", "")), to_epoch(d.get("timestamp")), d.get("content", ""), d,
+                 key=("post", d.get("id")))
+
+    def add_thread(self, d):
+        head = {k: v for k, v in d.items() if k != "responses"}
+        self.add("thread", (d.get("author", ""),), to_epoch(d.get("timestamp")), f"{d.get('title', '')}\n{d.get('body', '')}", head,
+                 key=("thread", d.get("id")))
+        for i, r in enumerate(d.get("responses") or []):
+            self.add("response", (r.get("name", ""),), to_epoch(r.get("timestamp")), r.get("content", ""),
+                     {**r, "thread_id": d.get("id"), "thread_title": d.get("title", "")}, key=("response", d.get("id"), i))
+
+    def add_archive_record(self, d):
+        kind = d.get("type")
+        if kind == "event": self.add_event(d)
+        elif kind == "tweet": self.add_tweet(d)
+
+    # --- 構築 ---
+    def load_archive(self, path):
+        """前回読んだ位置から追記分だけ取り込む（他プロセスの書き込みも拾える）"""
+        if not os.path.exists(path): return
+        with self.tail_lock, open(path, "rb") as f:
+            f.seek(self.archive_offset)
+            for line in f:
+                if not line.endswith(b"\n"): break  # 書きかけの行は次回
+                self.archive_offset += len(line)
+                try: self.add_archive_record(json.loads(line))
+                except ValueError: pass
+
+    def refresh_board(self, posts_path, threads_path):
+        """掲示板JSONが更新されていれば、未登録分だけ取り込む"""
+        for path, add in ((posts_path, self.add_post), (threads_path, self.add_thread)):
+            try: mtime = os.path.getmtime(path)
+            except OSError: continue
+            if self.file_mtimes.get(path) == mtime: continue
+            self.file_mtimes[path] = mtime
+            try:
+                with open(path, "r", encoding="utf-8") as f: items = json.load(f)
+            except: continue
+            for d in items:
+                if isinstance(d, dict): add(d)
+
+    @classmethod
+    def rebuild(cls, archive_path, history_path, status_path, posts_path, threads_path):
+        """アーカイブ + 現在のダッシュボードJSON + 掲示板から作り直す"""
+        index = cls()
+        index.load_archive(archive_path)
+        # アーカイブ導入前のデータは現在のダッシュボードJSONにしか残っていない（重複はキーで弾く）
+        try:
+            with open(history_path, "r", encoding="utf-8") as f: history = json.load(f)
+            for d in reversed(history):
+                if isinstance(d, dict): index.add_event(d)
+        except: pass
+        try:
+            with open(status_path, "r", encoding="utf-8") as f: status = json.load(f)
+            for d in reversed(status.get("sns", [])):
+                if isinstance(d, dict): index.add_tweet(d)
+        except: pass
+        index.refresh_board(posts_path, threads_path)
+        return index
+
+    # --- 検索 ---
+    def _matches(self, q):
+        """q を含む doc_id の集合"""
+        texts = self.texts
+        if len(q) < N:
+            return set(self.postings.get(q, ()))
+        # 本文で確認するので、q を覆う重ならない bi-gram だけで絞れば十分
+        cover = {q[i:i + N] for i in range(0, len(q) - 1, N)} | {q[-N:]}
+        lists = sorted((self.postings.get(g, ()) for g in cover), key=len)
+        ids = set(lists[0])
+        for other in lists[1:]:
+            if not ids: break
+            ids.intersection_update(other)
+        if len(q) > N:
+            # bi-gram が全部揃っていても連続しているとは限らないので本文で確認
+            ids = {i for i in ids if q in texts[i]}
+        return ids
+
+    def _newest(self, ids, k):
+        """ids のうち新しい順に k 件"""
+        if len(ids) < 4096:
+            return heapq.nlargest(k, ids, key=self.timestamps.__getitem__)
+        # ヒットが多いときは時系列の新しい方から歩き、k 件集まったら止める
+        top = []
+        for i in reversed(self.order_ids):
+            if i in ids:
+                top.append(i)
+                if len(top) == k: break
+        return top
+
+    def search(self, query, kind=None, user=None, page=1, per_page=20):
+        """条件に合う文書を timestamp の新しい順にページングして返す"""
+        t0 = time.perf_counter()
+        q = normalize(query).strip()
+        with self.lock:
+            sets = []
+            if q: sets.append(self._matches(q))
+            if kind: sets.append(self.by_kind.get(kind, set()))
+            if user: sets.append(self.by_user.get(user, set()))
+            if sets:
+                sets.sort(key=len)
+                ids = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+            else:
+                ids = range(len(self.texts))
+            start = (max(page, 1) - 1) * per_page
+            top = self._newest(ids, start + per_page)[start:]
+            hits = [{**self.payloads[i], "type": self.kinds[i], "timestamp": self.timestamps[i]} for i in top]
+        return {"total": len(ids), "page": page, "per_page": per_page, "hits": hits,
+                "took_ms": round((time.perf_counter() - t0) * 1000, 2)}
@@ -1,12 +1,51 @@
 # src/settings.py
+import json
+import socket
+try:
+    from llama_cpp import llama_supports_gpu_offload
+except ImportError:
+    llama_supports_gpu_offload = None
 
 # --- ⚙️ シミュレーション設定 ---
 MODEL_PATH = "./models/qwen2.5-3b-instruct-q4_k_m.gguf"
 DATA_FILE = "./data/company_status.json"
 HISTORY_FILE = "./data/history.json"
+ARCHIVE_FILE = "./data/archive.jsonl"  # 全履歴・SNSのアーカイブ（コンパクトJSONL）
+POSTS_FILE = "./data/posts.json"
+THREADS_FILE = "./data/threads.json"
 PORT = 8000
 SLEEP_TIME = 3600  # 1時間間隔
 
+# --- 🦙 llama.cpp 実行パラメータ ---
+# python src/tune_llama.py で計測したホスト別の最適値をプロファイルに書き出し、ここで読む。
+# プロファイルが無いホストでは DEFAULT_LLAMA_PARAMS を使う。
+LLAMA_PROFILE_FILE = "./models/llama_profile.json"
+DEFAULT_LLAMA_PARAMS = {"n_ctx": 2048, "n_gpu_layers": 25}  # プロンプトは最大でも数百トークン + 出力500
+
+def load_llama_params(path=LLAMA_PROFILE_FILE, host=None):
+    params = dict(DEFAULT_LLAMA_PARAMS)
+    try:
+        with open(path, "r", encoding="utf-8") as f: profile = json.load(f).get(host or socket.gethostname(), {})
+    except: profile = {}
+    params.update({k: v for k, v in profile.items() if k in ("n_ctx", "n_threads", "n_batch", "n_gpu_layers")})
+    if llama_supports_gpu_offload and not llama_supports_gpu_offload():
+        params["n_gpu_layers"] = 0  # CPUのみのビルドではオフロードしない
+    return params
+
+LLAMA_PARAMS = load_llama_params()
+
+# 介入API（edict / audit / rumor）の流入制御
+ACTION_RATE_PER_CLIENT = 1 / 60   # クライアントごと：1分に1回
+ACTION_BURST_PER_CLIENT = 2
+ACTION_RATE_GLOBAL = 1 / 20       # 全体：20秒に1回
+ACTION_BURST_GLOBAL = 3
+MAX_PENDING_REQUESTS = 6          # 未着手の介入の受付件数（まとめた分も含む）の上限。超えたら429
+
+# 締め切り：超過したら生成を打ち切り、前回コメントやテンプレートで代用する
+TICK_DEADLINE_SEC = 600  # 1ティック（定例イベント / 介入1件）の生成全体
+CALL_DEADLINE_SEC = 120  # LLM呼び出し1回（モデルロック待ちを含む）
+NEWS_TIMEOUT_SEC = 5     # ニュースRSSの取得
+
 # 初期ステータス
 INITIAL_STATE = {
     "funds": 3000,
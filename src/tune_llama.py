@@ -0,0 +1,110 @@
+# src/tune_llama.py
+# llama.cpp の実行パラメータ（n_threads / n_batch / n_gpu_layers / n_ctx）を
+# 実際のプロンプト構成（イベント1 + 武将コメント7 + SNS3〜4）で計測し、
+# 最速の組み合わせをホスト別プロファイル（settings.LLAMA_PROFILE_FILE）に書き出す。
+# 使い方: python src/tune_llama.py [--threads 4 8] [--batches 64 256] [--gpu-layers 0 -1] [--rounds 2]
+import os
+import json
+import time
+import socket
+import argparse
+import datetime
+import itertools
+from llama_cpp import Llama, llama_supports_gpu_offload
+
+try:
+    from settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, LLAMA_PROFILE_FILE
+    from records import CompanyState, load_history
+    from prompts import EVENT_MAX_TOKENS, SHORT_MAX_TOKENS, news_context_for, event_messages, comment_messages, sns_messages
+except ImportError:
+    from src.settings import CHARACTERS, MOBS, RIVALS, INITIAL_STATE, MODEL_PATH, DATA_FILE, HISTORY_FILE, LLAMA_PROFILE_FILE
+    from src.records import CompanyState, load_history
+    from src.prompts import EVENT_MAX_TOKENS, SHORT_MAX_TOKENS, news_context_for, event_messages, comment_messages, sns_messages
+
+# ニュース付きイベントの概要は RSS の summary がそのまま入るので、長めのダミーで最悪ケースを見る
+SAMPLE_NEWS = {"title": "生成AIの新モデルが公開、企業導入が加速", "summary": "国内外の企業で生成AIの導入が進んでいる。" * 12}
+
+def load_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f: return json.load(f)
+    except: return default
+
+def build_prompt_mix():
+    """1ティック分の (messages, max_tokens) の並び"""
+    state = CompanyState.from_dict(load_json(DATA_FILE, INITIAL_STATE))
+    history = load_history(load_json(HISTORY_FILE, []))
+    event = history[0].to_dict() if history else {"title": "謎の宴会", "description": "曹操が急に詩を読み始め、全員が徹夜させられた。"}
+
+    mix = [(event_messages(state, news_context_for(SAMPLE_NEWS)), EVENT_MAX_TOKENS)]
+    mix += [(comment_messages(name, c, c['bias'][0], event), SHORT_MAX_TOKENS) for name, c in CHARACTERS.items()]
+    mix += [(sns_messages(user, event), SHORT_MAX_TOKENS) for user in MOBS[:3] + RIVALS[:1]]
+    return mix
+
+def required_ctx(model_path, mix):
+    """プロンプト + 出力が収まる最小の n_ctx（2の累乗、余裕25%）"""
+    llm = Llama(model_path=model_path, n_ctx=512, n_gpu_layers=0, vocab_only=True, verbose=False)
+    need = 0
+    for messages, max_tokens in mix:
+        text = "".join(m["content"] for m in messages)
+        need = max(need, len(llm.tokenize(text.encode("utf-8"))) + 16 * len(messages) + max_tokens)
+    n_ctx = 512
+    while n_ctx < need * 1.25: n_ctx *= 2
+    return n_ctx, need
+
+def bench(model_path, params, mix, rounds):
+    """1ティックあたりの秒数（rounds 回の平均）と生成トークン/秒"""
+    llm = Llama(model_path=model_path, verbose=False, seed=0, **params)
+    llm.create_chat_completion(messages=mix[-1][0], max_tokens=8)  # ウォームアップ
+    tokens = 0
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for messages, max_tokens in mix:
+            # 設定間で出力長が変わらないよう、貪欲デコード（temperature=0, seed固定）で比べる
+            res = llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0)
+            tokens += res["usage"]["completion_tokens"]
+    elapsed = time.perf_counter() - t0
+    del llm
+    return elapsed / rounds, tokens / elapsed
+
+def default_threads():
+    n = os.cpu_count() or 4
+    return sorted({max(1, n // 4), max(1, n // 2), n})
+
+def main():
+    gpu = llama_supports_gpu_offload()
+    parser = argparse.ArgumentParser(description="llama.cpp 実行パラメータの自動チューニング")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--threads", type=int, nargs="+", default=default_threads())
+    parser.add_argument("--batches", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--gpu-layers", type=int, nargs="+", default=[0, 25, -1] if gpu else [0])
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--out", default=LLAMA_PROFILE_FILE)
+    args = parser.parse_args()
+
+    mix = build_prompt_mix()
+    n_ctx, need = required_ctx(args.model, mix)
+    print(f"--- 🦙 チューニング開始 ({args.model}) ---")
+    print(f"📏 最大 {need} トークン → n_ctx={n_ctx}  GPUオフロード: {'可' if gpu else '不可'}")
+
+    best = None
+    for n_threads, n_batch, n_gpu_layers in itertools.product(args.threads, args.batches, args.gpu_layers):
+        params = {"n_ctx": n_ctx, "n_threads": n_threads, "n_batch": n_batch, "n_gpu_layers": n_gpu_layers}
+        try:
+            tick_sec, tps = bench(args.model, params, mix, args.rounds)
+        except Exception as e:
+            print(f"⚠️ {params} 失敗: {e}"); continue
+        print(f"  threads={n_threads:<3} batch={n_batch:<4} gpu={n_gpu_layers:<3} {tick_sec:7.2f}s/tick  {tps:6.1f} tok/s")
+        if best is None or tick_sec < best[1]: best = (params, tick_sec)
+
+    if best is None:
+        print("❌ 有効な組み合わせがありませんでした"); return
+
+    params, tick_sec = best
+    profiles = load_json(args.out, {})
+    profiles[socket.gethostname()] = {**params, "tick_sec": round(tick_sec, 2), "tuned_at": datetime.datetime.now().isoformat(timespec="seconds")}
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f: json.dump(profiles, f, indent=2, ensure_ascii=False)
+    print(f"✅ 最速: {params} ({tick_sec:.2f}s/tick) → {args.out}")
+
+if __name__ == "__main__":
+    main()